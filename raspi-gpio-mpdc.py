@@ -24,10 +24,15 @@ __date__ = "06/14/2025"
 #    limitations under the License.
 
 # standard imports
+import importlib
 import logging
+import os
+import queue
 import signal
 import sys
-import time
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
 
 # 3rd party imports
 import gpiozero
@@ -36,171 +41,340 @@ import gpiozero
 from raspimpdc import RaspiBaseMPDClient
 
 
+@dataclass(frozen=True)
+class ButtonConfig:
+    """Parsed configuration of one button"""
+
+    __slots__ = (
+        "pin",
+        "pull_kwargs",
+        "on_press",
+        "event_func",
+        "bounce_time",
+    )
+
+    pin: int
+    pull_kwargs: Dict[str, Optional[bool]]
+    on_press: bool
+    event_func: Optional[Callable[[], None]]
+    bounce_time: float
+
+
+@dataclass(frozen=True)
+class RotEncConfig:
+    """Parsed configuration of one rotary encoder"""
+
+    __slots__ = (
+        "pin_a",
+        "pin_b",
+        "event_func_ccw",
+        "event_func_cw",
+        "bounce_time",
+    )
+
+    pin_a: int
+    pin_b: int
+    event_func_ccw: Optional[Callable[[], None]]
+    event_func_cw: Optional[Callable[[], None]]
+    bounce_time: float
+
+
 class RaspiGPIOMPDClient(RaspiBaseMPDClient):
-    VALUES_PULLUPDN = ["up", "dn", "upex", "dnex"]
-    VALUES_PRESSRELEASE = ["press", "release"]
-
-    PUD_SWITCHER = {
-        0: (True, None),
-        1: (False, None),
-        2: (None, False),
-        3: (None, True),
+    VALUES_PRESSRELEASE = frozenset(("press", "release"))
+
+    PUD_KWARGS = {
+        "up": {"pull_up": True, "active_state": None},
+        "dn": {"pull_up": False, "active_state": None},
+        "upex": {"pull_up": None, "active_state": False},
+        "dnex": {"pull_up": None, "active_state": True},
+    }
+
+    PIN_FACTORIES = {
+        "lgpio": ("gpiozero.pins.lgpio", "LGPIOFactory"),
+        "pigpio": ("gpiozero.pins.pigpio", "PiGPIOFactory"),
+        "rpigpio": ("gpiozero.pins.rpigpio", "RPiGPIOFactory"),
+        "native": ("gpiozero.pins.native", "NativeFactory"),
     }
+    PREFERRED_PIN_FACTORIES = ("lgpio", "pigpio")
+
+    # seconds to wait on exit for a running event function
+    MPD_WORKER_STOP_TIMEOUT = 1.0
 
     def __init__(self):
         super().__init__()
 
-        self._buttons = []
-        self._rotencs = []
-        self._usedpins = []
+        self._gpio_objects = []
+        self._usedpins = set()
 
         self.isValidGPIO = False
 
+        self._mpd_lock = threading.RLock()
+        self._mpd_queue = queue.SimpleQueue()
+        self._mpd_worker = None
+
+        self._event_handlers = {
+            name: self.queuedHandler(getattr(self, name))
+            for name in self.VALUES_TRIGGERED_EVENTS
+            if hasattr(self, name)
+        }
+        # event 'none' leaves the GPIO Zero callback unset
+        self._event_handlers.setdefault("none", None)
+
+    def __enter__(self):
+        """Start the MPD worker thread when entering the service context"""
+        self._mpd_worker = threading.Thread(
+            target=self.runMPDWorker, name="mpd-worker", daemon=True
+        )
+        self._mpd_worker.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Release GPIO inputs and disconnect from MPD when leaving the context"""
+        try:
+            for device in self._gpio_objects:
+                try:
+                    device.close()
+                except Exception as e:
+                    self._log.error(
+                        "Error while closing GPIO input %s! (%s)", device, e
+                    )
+            self._gpio_objects.clear()
+        finally:
+            if self.stopMPDWorker():
+                with self._mpd_lock:
+                    if self.isConnected:
+                        self._log.info("Disconnect from MPD.")
+                        self.mpd.disconnect()
+            else:
+                self._log.warning("MPD event still running, skip disconnect from MPD.")
+
+    @property
+    def mpdLock(self):
+        """Lock to hold while using the MPD client outside of the event functions"""
+        return self._mpd_lock
+
+    def queuedHandler(self, event_func):
+        """Return GPIO Zero callback which queues event function for the MPD worker.
+
+        The GPIO Zero callback threads thus never block on MPD commands. Event
+        functions run on the worker thread only, while holding the MPD lock."""
+
+        def handler():
+            self._mpd_queue.put(event_func)
+
+        return handler
+
+    def runMPDWorker(self):
+        """Run the queued event functions one after the other until None is queued"""
+        while True:
+            event_func = self._mpd_queue.get()
+            if event_func is None:
+                return
+
+            with self._mpd_lock:
+                try:
+                    event_func()
+                except Exception as e:
+                    self._log.exception("Error while triggering MPD event! (%s)", e)
+
+    def stopMPDWorker(self):
+        """Discard pending event functions and wait for the MPD worker to finish.
+
+        Return False if a running event function did not finish in time."""
+        if self._mpd_worker is None:
+            return True
+
+        try:
+            while True:
+                self._mpd_queue.get_nowait()
+        except queue.Empty:
+            pass
+
+        self._mpd_queue.put(None)
+        self._mpd_worker.join(self.MPD_WORKER_STOP_TIMEOUT)
+        if self._mpd_worker.is_alive():
+            return False
+
+        self._mpd_worker = None
+        return True
+
     def initLogging(self, log=None):
         """Initialize logging to journal"""
         super().initLogging(log)
 
         pinf = type(gpiozero.Device._default_pin_factory()).__name__
-        self._log.info(f"GPIO Zero default pin factory: {pinf}")
+        self._log.info("GPIO Zero default pin factory: %s", pinf)
 
     def checkConfig(self):
         """Return True if the configuration has mandatory section GPIO."""
         return self.config.has_section("GPIO")
 
-    def configButton(self, buttonConfig):
-        """Configure one button"""
-        pin = self.getButtonPin(buttonConfig[0])
-        if pin == -1:
-            return False
+    def initPinFactory(self, factoryName):
+        """Set the configured pin factory, or a preferred one if none is configured"""
+        factoryName = factoryName.strip().lower()
+        if factoryName:
+            return self.setPinFactory(factoryName)
 
-        pudMode = self.checkResistor(buttonConfig[1])
-        if pudMode == -1:
+        if "GPIOZERO_PIN_FACTORY" not in os.environ:
+            self.setPreferredPinFactory()
+        return True
+
+    def setPinFactory(self, factoryName):
+        """Set the GPIO Zero pin factory used for all buttons and rotary encoders"""
+        try:
+            moduleName, className = self.PIN_FACTORIES[factoryName]
+        except KeyError:
+            self._log.error(
+                "Invalid pin factory configuration! Only one of %s allowed!",
+                "/".join(self.PIN_FACTORIES),
+            )
             return False
 
         try:
-            pud, active = self.PUD_SWITCHER[pudMode]
+            self.loadPinFactory(moduleName, className)
         except Exception as e:
-            self._log.error(f"Could not convert pull resistor configuration! ({e})")
+            self._log.error("Could not load pin factory '%s'! (%s)", factoryName, e)
             return False
 
-        eventStr = buttonConfig[2]
-        if not self.checkButtonEvent(eventStr):
-            return False
+        return True
+
+    def setPreferredPinFactory(self):
+        """Set the first available of the preferred event driven pin factories.
 
-        event = True if eventStr == "press" else False
+        Keep the GPIO Zero default if none of them can be loaded."""
+        for factoryName in self.PREFERRED_PIN_FACTORIES:
+            moduleName, className = self.PIN_FACTORIES[factoryName]
+            try:
+                self.loadPinFactory(moduleName, className)
+                return
+            except Exception as e:
+                self._log.debug("Pin factory '%s' not available. (%s)", factoryName, e)
+
+        self._log.info("Keep GPIO Zero default pin factory.")
+
+    def loadPinFactory(self, moduleName, className):
+        """Create pin factory from GPIO Zero module and set it as default for devices"""
+        factory = getattr(importlib.import_module(moduleName), className)
+        gpiozero.Device.pin_factory = factory()
+        self._log.info("GPIO Zero pin factory: %s", className)
 
-        triggered_event = buttonConfig[3]
+    def parseButtonConfig(self, buttonConfig):
+        """Return ButtonConfig parsed from the values of one button configuration.
+
+        Return None if the configuration is invalid."""
+        pin = self.getButtonPin(buttonConfig[0])
+        if pin == -1:
+            return None
+
+        pullKwargs = self.getPullKwargs(buttonConfig[1].lower())
+        if pullKwargs is None:
+            return None
+
+        eventStr = buttonConfig[2].lower()
+        if not self.checkButtonEvent(eventStr):
+            return None
+
+        triggered_event = buttonConfig[3].lower()
         if not self.checkTriggeredEvent(triggered_event):
-            return False
+            return None
 
-        if len(buttonConfig) == 5:
-            try:
-                bouncetime = int(buttonConfig[4])
-            except Exception:
-                self._log.error("Invalid bounce time! (only integer >0 allowed)")
-                return False
-        else:
-            bouncetime = 50
+        if triggered_event not in self._event_handlers:
+            self._log.error("Could not determine event function!")
+            return None
+        event_func = self._event_handlers[triggered_event]
 
-        return self.setupButton(pin, pud, active, event, triggered_event, bouncetime)
+        bouncetime = self.getBounceTime(buttonConfig, 4, 50)
+        if bouncetime is None:
+            return None
 
-    def setupButton(self, pin, pull, active, event, triggered_event, bouncetime):
+        self._usedpins.add(pin)
+
+        return ButtonConfig(
+            pin, pullKwargs, eventStr == "press", event_func, 0.001 * bouncetime
+        )
+
+    def setupButton(self, cfg):
         """Setup GPIOZero object for button"""
         try:
+            # debouncing is done by the pin factory (e.g. pigpio glitch filter),
+            # it does not block callbacks of other pins
             button = gpiozero.Button(
-                pin,
-                pull_up=pull,
-                active_state=active,
-                bounce_time=0.001 * bouncetime,
+                cfg.pin,
+                **cfg.pull_kwargs,
+                bounce_time=cfg.bounce_time,
             )
-            self._usedpins.append(pin)
 
-            event_func = getattr(self, triggered_event)
-
-            if not event_func:
-                raise ValueError("Could not determine event function!")
-
-            if event:
-                button.when_pressed = event_func
-            else:
-                button.when_released = event_func
+            # leave callback unset for event 'none' (GPIO Zero warns on None)
+            if cfg.event_func is not None:
+                if cfg.on_press:
+                    button.when_pressed = cfg.event_func
+                else:
+                    button.when_released = cfg.event_func
 
-            self._buttons.append(button)
+            self._gpio_objects.append(button)
             return True
         except Exception as e:
-            self._log.error(f"Error while setting up GPIO input for button! ({e})")
+            self._log.error("Error while setting up GPIO input for button! (%s)", e)
             return False
 
-    def configRotEnc(self, rotencConfig):
-        """Configure one rotary encoder"""
+    def parseRotEncConfig(self, rotencConfig):
+        """Return RotEncConfig parsed from the values of one rotary encoder config.
+
+        Return None if the configuration is invalid."""
         pinA, pinB = self.getRotEncPins(rotencConfig[0], rotencConfig[1])
         if pinA == -1 or pinB == -1:
-            return False
-
-        pudMode = self.checkResistor(rotencConfig[2])
-        if pudMode == -1:
-            return False
+            return None
 
-        try:
-            pud, active = self.PUD_SWITCHER[pudMode]
-        except Exception as e:
-            self._log.error(f"Could not convert pull resistor configuration! ({e})")
-            return False
+        # only validated, gpiozero.RotaryEncoder does not take pull resistor arguments
+        if self.getPullKwargs(rotencConfig[2].lower()) is None:
+            return None
 
-        triggered_event_ccw = rotencConfig[3]
+        triggered_event_ccw = rotencConfig[3].lower()
         if not self.checkTriggeredEvent(triggered_event_ccw):
-            return False
+            return None
 
-        triggered_event_cw = rotencConfig[4]
+        triggered_event_cw = rotencConfig[4].lower()
         if not self.checkTriggeredEvent(triggered_event_cw):
-            return False
-
-        if len(rotencConfig) == 6:
-            try:
-                bouncetime = int(rotencConfig[5])
-            except Exception:
-                self._log.error("Invalid bounce time! (only integer >0 allowed)")
-                return False
-        else:
-            bouncetime = 20
-
-        return self.setupRotEnc(
-            pinA,
-            pinB,
-            pud,
-            triggered_event_ccw,
-            triggered_event_cw,
-            bouncetime,
+            return None
+
+        if (
+            triggered_event_ccw not in self._event_handlers
+            or triggered_event_cw not in self._event_handlers
+        ):
+            self._log.error("Could not determine event function!")
+            return None
+        event_func_ccw = self._event_handlers[triggered_event_ccw]
+        event_func_cw = self._event_handlers[triggered_event_cw]
+
+        bouncetime = self.getBounceTime(rotencConfig, 5, 20)
+        if bouncetime is None:
+            return None
+
+        self._usedpins.add(pinA)
+        self._usedpins.add(pinB)
+
+        return RotEncConfig(
+            pinA, pinB, event_func_ccw, event_func_cw, 0.001 * bouncetime
         )
 
-    def setupRotEnc(
-        self, pinA, pinB, pull, triggered_ccw_event, triggered_cw_event, bouncetime
-    ):
+    def setupRotEnc(self, cfg):
         """Setup GPIOZero rotary encoder object"""
         try:
             rotenc = gpiozero.RotaryEncoder(
-                pinA, pinB, bounce_time=0.001 * bouncetime, max_steps=50
+                cfg.pin_a, cfg.pin_b, bounce_time=cfg.bounce_time, max_steps=50
             )
 
-            self._usedpins.append(pinA)
-            self._usedpins.append(pinB)
+            # leave callback unset for event 'none' (GPIO Zero warns on None)
+            if cfg.event_func_ccw is not None:
+                rotenc.when_rotated_counter_clockwise = cfg.event_func_ccw
+            if cfg.event_func_cw is not None:
+                rotenc.when_rotated_clockwise = cfg.event_func_cw
 
-            event_func_ccw = getattr(self, triggered_ccw_event)
-            if not event_func_ccw:
-                raise ValueError("Could not determine event function!")
-
-            event_func_cw = getattr(self, triggered_cw_event)
-            if not event_func_cw:
-                raise ValueError("Could not determine event function!")
-
-            rotenc.when_rotated_counter_clockwise = event_func_ccw
-            rotenc.when_rotated_clockwise = event_func_cw
-
-            self._rotencs.append(rotenc)
+            self._gpio_objects.append(rotenc)
             return True
         except Exception as e:
             self._log.error(
-                f"Error while setting up GPIO input for rotary encoder! ({e})"
+                "Error while setting up GPIO input for rotary encoder! (%s)", e
             )
             return False
 
@@ -212,12 +386,12 @@ class RaspiGPIOMPDClient(RaspiBaseMPDClient):
             pin = int(pinStr)
 
             if pin in self._usedpins:
-                self._log.error(f"Pin {pin} already in use!")
+                self._log.error("Pin %d already in use!", pin)
                 return -1
 
             return pin
         except Exception as e:
-            self._log.error(f"Invalid pin configuration! ({e})")
+            self._log.error("Invalid pin configuration! (%s)", e)
             return -1
 
     def getRotEncPins(self, pinAStr, pinBStr):
@@ -233,29 +407,47 @@ class RaspiGPIOMPDClient(RaspiBaseMPDClient):
                 return -1, -1
 
             if pinA in self._usedpins:
-                self._log.error(f"Pin {pinA} already in use!")
+                self._log.error("Pin %d already in use!", pinA)
                 return -1, 0
 
             if pinB in self._usedpins:
-                self._log.error(f"Pin {pinB} already in use!")
+                self._log.error("Pin %d already in use!", pinB)
                 return 0, -1
 
             return pinA, pinB
         except Exception as e:
-            self._log.error(f"Invalid pin configuration! ({e})")
+            self._log.error("Invalid pin configuration! (%s)", e)
             return -1, -1
 
-    def checkResistor(self, pudStr):
-        """Return index if string is found in pre-defined values for pull resistor types"""
+    def getBounceTime(self, config, index, default):
+        """Return the optional bounce time in milliseconds at index of config values.
+
+        Return default if it is not given, or None if it is invalid."""
+        if len(config) <= index:
+            return default
+
         try:
-            return self.VALUES_PULLUPDN.index(pudStr)
+            bouncetime = int(config[index])
         except Exception:
+            bouncetime = 0
+
+        if bouncetime < 1:
+            self._log.error("Invalid bounce time! (only integer >0 allowed)")
+            return None
+
+        return bouncetime
+
+    def getPullKwargs(self, pudStr):
+        """Return the GPIO Zero pull resistor arguments for a pull resistor type.
+
+        Return None if the type is not one of the pre-defined values."""
+        pullKwargs = self.PUD_KWARGS.get(pudStr)
+        if pullKwargs is None:
             self._log.error(
-                "Invalid resistor configuration! Only one of {0} allowed!".format(
-                    "/".join(self.VALUES_PULLUPDN)
-                )
+                "Invalid resistor configuration! Only one of %s allowed!",
+                "/".join(self.PUD_KWARGS),
             )
-            return -1
+        return pullKwargs
 
     def checkButtonEvent(self, buttonEvent):
         """Return if string is in pre-defined values for button events"""
@@ -273,21 +465,36 @@ class RaspiGPIOMPDClient(RaspiBaseMPDClient):
 
         self._vol_step = 1
 
+        if not self.initPinFactory(configGPIO.get("pin_factory", "")):
+            return False
+
+        configFuncs = {
+            "button": ("Button", self.parseButtonConfig, self.setupButton),
+            "rotenc": ("RotEnc", self.parseRotEncConfig, self.setupRotEnc),
+        }
+
+        # parse all entries before any GPIO Zero object is created
+        inputs = []
         for key, value in configGPIO.items():
-            if key.startswith("button"):
-                self._log.info(f"Button configuration '{key} = {value}'")
-                if not self.configButton(value.lower().split(",")):
-                    return False
+            if key == "pin_factory":
                 continue
 
-            if key.startswith("rotenc"):
-                self._log.info(f"RotEnc configuration '{key} = {value}'")
-                if not self.configRotEnc(value.lower().split(",")):
-                    return False
-                continue
+            try:
+                name, parseFunc, setupFunc = configFuncs[key[:6]]
+            except KeyError:
+                self._log.info("Invalid key '%s'!", key)
+                return False
 
-            self._log.info(f"Invalid key '{key}'!")
-            return False
+            self._log.info("%s configuration '%s = %s'", name, key, value)
+            cfg = parseFunc([v.strip() for v in value.split(",")])
+            if cfg is None:
+                return False
+
+            inputs.append((setupFunc, cfg))
+
+        for setupFunc, cfg in inputs:
+            if not setupFunc(cfg):
+                return False
 
         self.isValidGPIO = True
         return True
@@ -303,49 +510,45 @@ def main():
     signal.signal(signal.SIGTERM, sigterm_handler)
 
     log = None
-    mpdclient = None
 
     try:
         log = logging.getLogger(__name__)
 
-        mpdclient = RaspiGPIOMPDClient()
-        if log:
-            mpdclient.initLogging(log)
+        with RaspiGPIOMPDClient() as mpdclient:
+            if log:
+                mpdclient.initLogging(log)
 
-        if not mpdclient.readConfigFile():
-            sys.exit(-2)
+            if not mpdclient.readConfigFile():
+                sys.exit(-2)
 
-        if not mpdclient.checkConfig():
-            log.error("Invalid configuration file! (section [GPIO] missing)")
-            sys.exit(-3)
+            if not mpdclient.checkConfig():
+                log.error("Invalid configuration file! (section [GPIO] missing)")
+                sys.exit(-3)
 
-        mpdclient.setLogLevel()
+            mpdclient.setLogLevel()
 
-        if not mpdclient.initGPIO():
-            log.error("Init GPIO failed!")
-            sys.exit(-3)
+            if not mpdclient.initGPIO():
+                log.error("Init GPIO failed!")
+                sys.exit(-3)
 
-        if not mpdclient.initMPD():
-            log.error("Init MPD connection failed!")
-            sys.exit(-4)
+            # GPIO events may already use the MPD client, so serialize the setup
+            with mpdclient.mpdLock:
+                if not mpdclient.initMPD():
+                    log.error("Init MPD connection failed!")
+                    sys.exit(-4)
 
-        if not mpdclient.isConnected and not mpdclient.connectMPD():
-            log.error("Could not connect to MPD server - possibly timed out!")
-            sys.exit(-5)
+                if not mpdclient.isConnected and not mpdclient.connectMPD():
+                    log.error("Could not connect to MPD server - possibly timed out!")
+                    sys.exit(-5)
 
-        log.info("Enter raspi-gpio-mpdc service loop...")
-        while True:
-            time.sleep(0.1)
+            log.info("Enter raspi-gpio-mpdc service loop...")
+            while True:
+                signal.pause()
 
     except Exception as e:
         if log:
-            log.exception(f"Unhandled exception: {e}")
+            log.exception("Unhandled exception: %s", e)
         sys.exit(-1)
-    finally:
-        if mpdclient and mpdclient.isConnected:
-            if log:
-                log.info("Disconnect from MPD.")
-            mpdclient.mpd.disconnect()
 
 
 # run as script only